@@ -2,17 +2,20 @@
 CRUD operations for database models.
 """
 
-import uuid
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, insert, lambda_stmt, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from backend.models import SessionDB, MessageDB
 
 
+# Hot single-row statements are built with lambda_stmt so SQLAlchemy caches
+# the constructed statement and only re-binds the parameters on each call.
+
+
 # ===== Session CRUD =====
 
 async def create_session(
@@ -21,46 +24,74 @@ async def create_session(
     provider: str,
     system_prompt_suffix: Optional[str] = None
 ) -> SessionDB:
-    """Create a new session."""
+    """
+    Create a new session.
+
+    Only flushes; the caller owns the transaction and decides when to commit.
+    """
     session = SessionDB(
-        id=str(uuid.uuid4()),
         model=model,
         provider=provider,
         system_prompt_suffix=system_prompt_suffix,
     )
     db.add(session)
-    await db.commit()
-    await db.refresh(session)
+    await db.flush()
     return session
 
 
 async def get_session(db: AsyncSession, session_id: str) -> Optional[SessionDB]:
     """Get a session by ID."""
     result = await db.execute(
-        select(SessionDB).where(SessionDB.id == session_id)
+        lambda_stmt(lambda: select(SessionDB).where(SessionDB.id == session_id))
     )
     return result.scalar_one_or_none()
 
 
-async def get_sessions(
+async def get_session_with_messages(
     db: AsyncSession,
-    skip: int = 0,
-    limit: int = 100
-) -> List[SessionDB]:
-    """Get all sessions."""
+    session_id: str
+) -> Optional[SessionDB]:
+    """
+    Get a session by ID with its messages eagerly loaded.
+
+    Use this instead of touching ``.messages`` on a session from
+    ``get_session``, which would need a lazy load per session.
+    """
     result = await db.execute(
         select(SessionDB)
-        .order_by(SessionDB.created_at.desc())
-        .offset(skip)
-        .limit(limit)
+        .options(selectinload(SessionDB.messages))
+        .where(SessionDB.id == session_id)
     )
+    return result.scalar_one_or_none()
+
+
+async def get_sessions(
+    db: AsyncSession,
+    cursor: Optional[Tuple[datetime, str]] = None,
+    limit: int = 100,
+    with_messages: bool = False
+) -> List[SessionDB]:
+    """
+    Get sessions, newest first.
+
+    Uses keyset pagination: pass the (created_at, id) of the last session
+    from the previous page as ``cursor`` to fetch the next one. Set
+    ``with_messages`` to load every session's messages in one extra query
+    rather than one lazy load per session.
+    """
+    stmt = select(SessionDB).order_by(SessionDB.created_at.desc(), SessionDB.id.desc())
+    if with_messages:
+        stmt = stmt.options(selectinload(SessionDB.messages))
+    if cursor is not None:
+        stmt = stmt.where(tuple_(SessionDB.created_at, SessionDB.id) < cursor)
+    result = await db.execute(stmt.limit(limit))
     return list(result.scalars().all())
 
 
 async def delete_session(db: AsyncSession, session_id: str) -> bool:
     """Delete a session."""
     result = await db.execute(
-        delete(SessionDB).where(SessionDB.id == session_id)
+        lambda_stmt(lambda: delete(SessionDB).where(SessionDB.id == session_id))
     )
     await db.commit()
     return result.rowcount > 0
@@ -72,16 +103,30 @@ async def update_session(
     **kwargs
 ) -> Optional[SessionDB]:
     """Update a session."""
-    session = await get_session(db, session_id)
-    if not session:
-        return None
+    stmt = (
+        update(SessionDB)
+        .where(SessionDB.id == session_id)
+        .values(**kwargs)
+    )
     
-    for key, value in kwargs.items():
-        setattr(session, key, value)
+    if db.get_bind().dialect.update_returning:
+        # Single round-trip: UPDATE ... RETURNING the updated row
+        result = await db.execute(stmt.returning(SessionDB))
+        session = result.scalar_one_or_none()
+    else:
+        # Older SQLite has no RETURNING; read the row back if it matched,
+        # overwriting any stale copy already in the session
+        result = await db.execute(stmt)
+        session = None
+        if result.rowcount:
+            result = await db.execute(
+                select(SessionDB)
+                .where(SessionDB.id == session_id)
+                .execution_options(populate_existing=True)
+            )
+            session = result.scalar_one_or_none()
     
-    session.updated_at = datetime.utcnow()
     await db.commit()
-    await db.refresh(session)
     return session
 
 
@@ -93,40 +138,69 @@ async def create_message(
     role: str,
     content: list
 ) -> MessageDB:
-    """Create a new message."""
+    """
+    Create a new message.
+
+    Only flushes; the caller owns the transaction and decides when to commit.
+    """
     message = MessageDB(
-        id=str(uuid.uuid4()),
         session_id=session_id,
         role=role,
         content=content,
     )
     db.add(message)
-    await db.commit()
-    await db.refresh(message)
+    await db.flush()
     return message
 
 
+async def create_messages(
+    db: AsyncSession,
+    rows: List[Dict[str, Any]]
+) -> List[str]:
+    """
+    Create several messages with a single batched INSERT.
+
+    Each row needs ``session_id``, ``role`` and ``content``. Returns the new
+    message IDs in row order. Like create_message, this does not commit.
+    """
+    if not rows:
+        return []
+    result = await db.execute(
+        insert(MessageDB).returning(MessageDB.id, sort_by_parameter_order=True),
+        rows
+    )
+    return list(result.scalars().all())
+
+
 async def get_messages(
     db: AsyncSession,
     session_id: str,
-    skip: int = 0,
+    cursor: Optional[Tuple[datetime, str]] = None,
     limit: int = 100
 ) -> List[MessageDB]:
-    """Get messages for a session."""
-    result = await db.execute(
-        select(MessageDB)
+    """
+    Get messages for a session, oldest first.
+
+    Uses keyset pagination: pass the (timestamp, id) of the last message
+    from the previous page as ``cursor`` to fetch the next one.
+    """
+    stmt = lambda_stmt(
+        lambda: select(MessageDB)
         .where(MessageDB.session_id == session_id)
-        .order_by(MessageDB.timestamp.asc())
-        .offset(skip)
-        .limit(limit)
+        .order_by(MessageDB.timestamp.asc(), MessageDB.id.asc())
     )
+    if cursor is not None:
+        after_cursor = tuple_(MessageDB.timestamp, MessageDB.id) > cursor
+        stmt += lambda s: s.where(after_cursor)
+    stmt += lambda s: s.limit(limit)
+    result = await db.execute(stmt)
     return list(result.scalars().all())
 
 
 async def get_message(db: AsyncSession, message_id: str) -> Optional[MessageDB]:
     """Get a message by ID."""
     result = await db.execute(
-        select(MessageDB).where(MessageDB.id == message_id)
+        lambda_stmt(lambda: select(MessageDB).where(MessageDB.id == message_id))
     )
     return result.scalar_one_or_none()
 
@@ -134,7 +208,7 @@ async def get_message(db: AsyncSession, message_id: str) -> Optional[MessageDB]:
 async def delete_message(db: AsyncSession, message_id: str) -> bool:
     """Delete a message."""
     result = await db.execute(
-        delete(MessageDB).where(MessageDB.id == message_id)
+        lambda_stmt(lambda: delete(MessageDB).where(MessageDB.id == message_id))
     )
     await db.commit()
     return result.rowcount > 0
@@ -3,12 +3,14 @@ Database configuration and connection management.
 """
 
 import os
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator
 
+import orjson
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.pool import NullPool
 
-from backend.models import Base
+from backend.models import Base, MessageDB
 
 # Database URL - use PostgreSQL in production, SQLite for development
 DATABASE_URL = os.getenv(
@@ -22,13 +24,59 @@ if DATABASE_URL.startswith("postgres://"):
 elif DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-# Create async engine
+
+def _json_serializer(value: Any) -> str:
+    """Serialize JSON columns with orjson; drivers expect text, not bytes."""
+    return orjson.dumps(value).decode()
+
+
+# Connection pool settings. SQLite opens a fresh connection per session;
+# server databases keep a sized pool so request handlers and long-lived
+# WebSocket/SSE handlers don't starve each other.
+if "sqlite" in DATABASE_URL:
+    pool_options = {"poolclass": NullPool}
+else:
+    pool_options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "3600")),
+        "pool_pre_ping": True,
+    }
+
+# Create async engine. JSON columns go through orjson rather than the
+# stdlib json module, which matters for message content carrying
+# base64 screenshots.
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,
-    poolclass=NullPool if "sqlite" in DATABASE_URL else None,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    **pool_options,
 )
 
+
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    Configure new SQLite connections.
+
+    SQLite ignores foreign keys unless asked to enforce them; message inserts
+    rely on the session_id constraint to reject unknown sessions. WAL with
+    synchronous=NORMAL avoids an fsync on every commit, at the cost of the
+    last transactions on power loss (never corruption).
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
+if "sqlite" in DATABASE_URL:
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragma)
+
 # Create async session factory
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -39,10 +87,76 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+def _add_message_cascade(connection):
+    """
+    Rebuild an old SQLite messages table whose session_id foreign key lacks
+    ON DELETE CASCADE.
+
+    SQLite can't alter a constraint in place. With foreign keys enforced,
+    deleting a session from such a table would fail once it has messages.
+    """
+    foreign_keys = connection.exec_driver_sql("PRAGMA foreign_key_list(messages)").fetchall()
+    # Rows are (id, seq, table, from, to, on_update, on_delete, match)
+    if not any(fk[2] == "sessions" and fk[6] != "CASCADE" for fk in foreign_keys):
+        return
+    
+    table = MessageDB.__table__
+    columns = ", ".join(column.name for column in table.columns)
+    for index in table.indexes:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    connection.exec_driver_sql("ALTER TABLE messages RENAME TO messages_old")
+    table.create(connection)
+    # Orphans could exist while foreign keys weren't enforced; leave them behind
+    connection.exec_driver_sql(
+        f"INSERT INTO messages ({columns}) SELECT {columns} FROM messages_old "
+        f"WHERE session_id IN (SELECT id FROM sessions)"
+    )
+    connection.exec_driver_sql("DROP TABLE messages_old")
+
+
+def _check_column_types(connection):
+    """
+    Refuse to start on tables whose column types predate the current models.
+
+    create_all never alters existing tables. On PostgreSQL, ids that are
+    still VARCHAR would fail every lookup against the UUID parameters, so
+    stop here and point at the upgrade steps instead.
+    """
+    dialect = connection.dialect
+    inspector = inspect(connection)
+    mismatches = []
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            expected = column.type.compile(dialect=dialect)
+            found = existing[column.name].compile(dialect=dialect) if column.name in existing else "missing"
+            if found != expected:
+                mismatches.append(f"{table.name}.{column.name} is {found}, expected {expected}")
+    
+    if mismatches:
+        raise RuntimeError(
+            "Database schema is out of date (see 'Upgrading an Existing Database' "
+            "in README_BACKEND.md): " + "; ".join(mismatches)
+        )
+
+
+def _create_all(connection):
+    """Create missing tables, then any indexes added since they were created."""
+    Base.metadata.create_all(connection)
+    if connection.dialect.name == "sqlite":
+        # SQLite columns aren't strictly typed; only the foreign key matters
+        _add_message_cascade(connection)
+    else:
+        _check_column_types(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def init_db():
-    """Initialize database tables."""
+    """Initialize database tables and indexes."""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_all)
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -4,23 +4,27 @@ Provides session management, real-time streaming, and VNC connection APIs.
 """
 
 import asyncio
+import base64
+import binascii
 import json
 import logging
 import os
 import uuid
 from contextlib import asynccontextmanager
-from datetime import datetime
-from typing import AsyncGenerator, Optional
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends
+import orjson
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.models import SessionCreate, SessionResponse, MessageCreate, MessageResponse
+from backend.models import SessionCreate, SessionResponse, MessageCreate
 from backend.database import init_db, get_db
-from backend.session_manager import SessionManager
+from backend.session_manager import SSE_CLOSE, SessionManager
 from backend.vnc_proxy import VNCProxy
 from backend import crud
 
@@ -31,6 +35,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Response header carrying the cursor for the next page of a list endpoint
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -50,7 +57,8 @@ app = FastAPI(
     title="Computer Use Demo API",
     description="FastAPI backend for Anthropic Computer Use Demo with session management, real-time streaming, and VNC access",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # CORS middleware
@@ -60,6 +68,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Initialize managers
@@ -67,6 +76,29 @@ session_manager = SessionManager()
 vnc_proxy = VNCProxy()
 
 
+def _encode_cursor(timestamp: datetime, row_id: str) -> str:
+    """Encode a (timestamp, id) keyset position as an opaque cursor."""
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode an opaque cursor produced by _encode_cursor."""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), str(uuid.UUID(row_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+
+
+def _parse_session_id(session_id: str) -> str:
+    """Normalise a session ID from the path; anything that isn't a UUID can't exist."""
+    try:
+        return str(uuid.UUID(session_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Session not found") from None
+
+
 # ===== Session Management APIs =====
 
 @app.post("/api/sessions", response_model=SessionResponse)
@@ -76,12 +108,13 @@ async def create_session(
 ) -> SessionResponse:
     """Create a new chat session."""
     try:
-        db_session = await crud.create_session(
-            db,
-            model=session.model,
-            provider=session.provider,
-            system_prompt_suffix=session.system_prompt_suffix
-        )
+        async with db.begin():
+            db_session = await crud.create_session(
+                db,
+                model=session.model,
+                provider=session.provider,
+                system_prompt_suffix=session.system_prompt_suffix
+            )
         
         # Initialize session in manager
         session_manager.create_session(
@@ -111,6 +144,7 @@ async def get_session(
     db: AsyncSession = Depends(get_db)
 ) -> SessionResponse:
     """Get session details."""
+    session_id = _parse_session_id(session_id)
     db_session = await crud.get_session(db, session_id)
     if not db_session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -127,14 +161,27 @@ async def get_session(
 
 @app.get("/api/sessions")
 async def list_sessions(
-    skip: int = 0,
+    response: Response,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: AsyncSession = Depends(get_db)
 ):
-    """List all sessions."""
-    sessions = await crud.get_sessions(db, skip=skip, limit=limit)
+    """
+    List sessions, newest first.
+    If more sessions may follow, the next page's cursor is returned in the
+    X-Next-Cursor header.
+    """
+    sessions = await crud.get_sessions(
+        db,
+        cursor=_decode_cursor(cursor) if cursor else None,
+        limit=limit
+    )
+    if sessions and len(sessions) == limit:
+        last = sessions[-1]
+        response.headers[NEXT_CURSOR_HEADER] = _encode_cursor(last.created_at, last.id)
+    # Rows come straight from the database, so skip re-validating them
     return [
-        SessionResponse(
+        SessionResponse.model_construct(
             id=s.id,
             model=s.model,
             provider=s.provider,
@@ -152,6 +199,7 @@ async def delete_session(
     db: AsyncSession = Depends(get_db)
 ):
     """Delete a session."""
+    session_id = _parse_session_id(session_id)
     success = await crud.delete_session(db, session_id)
     if not success:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -167,22 +215,42 @@ async def delete_session(
 @app.get("/api/sessions/{session_id}/messages")
 async def get_messages(
     session_id: str,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: AsyncSession = Depends(get_db)
-):
-    """Get messages for a session."""
-    messages = await crud.get_messages(db, session_id, skip=skip, limit=limit)
-    return [
-        MessageResponse(
-            id=m.id,
-            session_id=m.session_id,
-            role=m.role,
-            content=m.content,
-            timestamp=m.timestamp
-        )
+) -> Response:
+    """
+    Get messages for a session, oldest first.
+    If more messages may follow, the next page's cursor is returned in the
+    X-Next-Cursor header.
+    """
+    session_id = _parse_session_id(session_id)
+    messages = await crud.get_messages(
+        db,
+        session_id,
+        cursor=_decode_cursor(cursor) if cursor else None,
+        limit=limit
+    )
+    
+    headers = {}
+    if messages and len(messages) == limit:
+        last = messages[-1]
+        headers[NEXT_CURSOR_HEADER] = _encode_cursor(last.timestamp, last.id)
+    
+    # Message content can carry large base64 screenshots; encode it in a
+    # worker thread so WebSocket/SSE streams aren't blocked meanwhile.
+    rows = [
+        {
+            "id": m.id,
+            "session_id": m.session_id,
+            "role": m.role,
+            "content": m.content,
+            "timestamp": m.timestamp,
+        }
         for m in messages
     ]
+    payload = await asyncio.get_running_loop().run_in_executor(None, orjson.dumps, rows)
+    return Response(payload, media_type="application/json", headers=headers)
 
 
 @app.post("/api/sessions/{session_id}/messages")
@@ -195,18 +263,19 @@ async def send_message(
     Send a message and process it.
     Returns immediately with message ID. Use WebSocket or SSE for real-time updates.
     """
-    # Verify session exists
-    db_session = await crud.get_session(db, session_id)
-    if not db_session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Store user message
-    user_message = await crud.create_message(
-        db,
-        session_id=session_id,
-        role="user",
-        content=[{"type": "text", "text": message.content}]
-    )
+    session_id = _parse_session_id(session_id)
+    # Store user message. The session_id foreign key doubles as the
+    # existence check, so this is a single INSERT in a single transaction.
+    try:
+        async with db.begin():
+            user_message = await crud.create_message(
+                db,
+                session_id=session_id,
+                role="user",
+                content=[{"type": "text", "text": message.content}]
+            )
+    except IntegrityError:
+        raise HTTPException(status_code=404, detail="Session not found") from None
     
     # Queue the message for processing
     session_manager.queue_message(session_id, message.content)
@@ -265,21 +334,21 @@ async def sse_endpoint(session_id: str):
     Alternative to WebSocket for one-way communication.
     """
     
-    async def event_generator() -> AsyncGenerator[str, None]:
+    async def event_generator() -> AsyncGenerator[bytes, None]:
         """Generate SSE events."""
         queue = asyncio.Queue()
         session_manager.add_sse_client(session_id, queue)
         
         try:
             while True:
-                # Wait for events
-                event = await queue.get()
+                # Wait for events, already formatted as SSE frames by the
+                # session manager
+                frame = await queue.get()
                 
-                if event.get("type") == "close":
+                if frame is SSE_CLOSE:
                     break
                 
-                # Format as SSE
-                yield f"data: {json.dumps(event)}\n\n"
+                yield frame
                 
         except asyncio.CancelledError:
             logger.info(f"SSE connection cancelled for session: {session_id}")
@@ -317,7 +386,7 @@ async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
         "active_sessions": len(session_manager.sessions)
     }
 
@@ -2,46 +2,116 @@
 Database models and schemas.
 """
 
-from datetime import datetime
+import uuid
+from datetime import datetime, timezone
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, String, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Index, JSON, Uuid
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
 
+def _new_id() -> str:
+    """Generate a primary key for a new row."""
+    return str(uuid.uuid4())
+
+
+# Native UUID on PostgreSQL; SQLite keeps the VARCHAR(36) of existing
+# databases so their rows stay reachable. Exposed as str in Python.
+_IdType = Uuid(as_uuid=False).with_variant(String(36), "sqlite")
+
+
+def _utcnow() -> datetime:
+    """Current time as an aware UTC datetime."""
+    return datetime.now(timezone.utc)
+
+
+class server_utcnow(FunctionElement):
+    """Current UTC time, evaluated by the database."""
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+
+@compiles(server_utcnow)
+def _compile_server_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(server_utcnow, "sqlite")
+def _compile_server_utcnow_sqlite(element, compiler, **kw):
+    # SQLite stores datetimes as text and compares them as strings, so match
+    # the microsecond format SQLAlchemy writes (CURRENT_TIMESTAMP has none)
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
 # ===== SQLAlchemy Models =====
 
 class SessionDB(Base):
     """Database model for chat sessions."""
     __tablename__ = "sessions"
 
-    id = Column(String, primary_key=True)
+    id = Column(_IdType, primary_key=True, default=_new_id)
     model = Column(String, nullable=False)
     provider = Column(String, nullable=False)
     system_prompt_suffix = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Timestamps are generated by the database. The column defaults put the
+    # expression in the INSERT itself, since tables created before the
+    # server defaults existed don't have them.
+    created_at = Column(DateTime(timezone=True), default=server_utcnow(), server_default=server_utcnow())
+    updated_at = Column(
+        DateTime(timezone=True),
+        default=server_utcnow(),
+        server_default=server_utcnow(),
+        onupdate=server_utcnow()
+    )
     
-    # Relationship
-    messages = relationship("MessageDB", back_populates="session", cascade="all, delete-orphan")
+    # Relationship. Not loaded by default; use crud.get_session_with_messages
+    # or get_sessions(with_messages=True) to fetch messages eagerly.
+    messages = relationship(
+        "MessageDB",
+        back_populates="session",
+        order_by="MessageDB.timestamp",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    __table_args__ = (
+        # Serves the keyset-paginated session list
+        Index("ix_sessions_created_at_id", "created_at", "id"),
+    )
+
+    # Fetch server-generated timestamps in the INSERT/UPDATE itself (RETURNING)
+    # instead of expiring them and lazy-loading later
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class MessageDB(Base):
     """Database model for chat messages."""
     __tablename__ = "messages"
 
-    id = Column(String, primary_key=True)
-    session_id = Column(String, ForeignKey("sessions.id"), nullable=False)
+    id = Column(_IdType, primary_key=True, default=_new_id)
+    session_id = Column(_IdType, ForeignKey("sessions.id", ondelete="CASCADE"), nullable=False)
     role = Column(String, nullable=False)  # user, assistant
-    content = Column(JSON, nullable=False)  # Store as JSON array
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    # Store as JSON array (binary JSONB on PostgreSQL)
+    content = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    # Set per row in Python rather than by the server: message order relies on
+    # it, and the server clock is too coarse (SQLite: whole seconds) or fixed
+    # for the whole transaction (PostgreSQL now()) to order a batched turn.
+    timestamp = Column(DateTime(timezone=True), default=_utcnow)
     
     # Relationship
     session = relationship("SessionDB", back_populates="messages")
 
+    __table_args__ = (
+        # Serves get_messages (filter by session, order by time) without a sort
+        Index("ix_msg_session_ts", "session_id", "timestamp"),
+    )
+
 
 # ===== Pydantic Models (API Schemas) =====
 
@@ -5,27 +5,100 @@ Session manager for handling active sessions and message processing.
 import asyncio
 import logging
 import os
-from typing import Dict, Optional, Any, Callable
-from collections import defaultdict
+from typing import Dict, Optional, Callable
+from dataclasses import dataclass, field
 
+import orjson
 from fastapi import WebSocket
 from anthropic.types.beta import BetaContentBlockParam
 
 from computer_use_demo.loop import sampling_loop, APIProvider
 from computer_use_demo.tools import ToolResult
 
+from backend import crud
+from backend.database import AsyncSessionLocal
+
 logger = logging.getLogger(__name__)
 
+# Put on an SSE client's queue to end its stream
+SSE_CLOSE = None
+
+# Maximum number of sampling-loop events waiting to be broadcast per session
+EVENT_QUEUE_MAXSIZE = 1024
+
+# Maximum number of events buffered for one WebSocket client; past this the
+# oldest pending event is dropped so a slow client can't stall broadcasts
+WEBSOCKET_OUTBOX_MAXSIZE = 64
+
+
+# Upper bound on the conversation history kept (and sent to the API) per
+# session; 0 keeps everything
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "100"))
+
+
+def _trim_history(messages: list, max_messages: int) -> list:
+    """
+    Drop the oldest messages so at most max_messages remain.
+
+    The kept window always starts at a plain user prompt, never at a tool
+    result whose tool_use was cut off, so it is still a valid conversation.
+    A turn longer than the limit is kept whole.
+    """
+    if not max_messages or len(messages) <= max_messages:
+        return messages
+    
+    def starts_turn(message: dict) -> bool:
+        content = message["content"]
+        if message["role"] != "user":
+            return False
+        if isinstance(content, str):
+            return True
+        return not any(block.get("type") == "tool_result" for block in content)
+    
+    turn_starts = [i for i, message in enumerate(messages) if starts_turn(message)]
+    start = len(messages) - max_messages
+    for i in turn_starts:
+        if i >= start:
+            return messages[i:]
+    return messages[turn_starts[-1]:] if turn_starts else messages
+
+
+@dataclass(slots=True)
+class WebSocketClient:
+    """A connected WebSocket client and the task writing to it."""
+    outbox: asyncio.Queue
+    writer: asyncio.Task
+
+
+@dataclass(kw_only=True, slots=True)
+class SessionState:
+    """Everything the manager keeps for one active session."""
+    model: str
+    provider: str
+    system_prompt_suffix: str = ""
+    api_key: str = ""
+    messages: list = field(default_factory=list)
+    message_queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    event_queue: asyncio.Queue = field(
+        default_factory=lambda: asyncio.Queue(maxsize=EVENT_QUEUE_MAXSIZE)
+    )
+    websocket_clients: Dict[WebSocket, WebSocketClient] = field(default_factory=dict)
+    sse_clients: set[asyncio.Queue] = field(default_factory=set)
+    processing_task: Optional[asyncio.Task] = None
+    event_consumer: Optional[asyncio.Task] = None
+
 
 class SessionManager:
     """Manages active chat sessions and their message queues."""
     
-    def __init__(self):
-        self.sessions: Dict[str, Dict[str, Any]] = {}
-        self.message_queues: Dict[str, asyncio.Queue] = {}
-        self.websocket_clients: Dict[str, set[WebSocket]] = defaultdict(set)
-        self.sse_clients: Dict[str, set[asyncio.Queue]] = defaultdict(set)
-        self.processing_tasks: Dict[str, asyncio.Task] = {}
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        max_history_messages: int = MAX_HISTORY_MESSAGES
+    ):
+        self.session_factory = session_factory
+        self.max_history_messages = max_history_messages
+        self.sessions: Dict[str, SessionState] = {}
         
     def create_session(
         self,
@@ -35,111 +108,147 @@ class SessionManager:
         system_prompt_suffix: str = ""
     ):
         """Create a new session."""
-        self.sessions[session_id] = {
-            "model": model,
-            "provider": provider,
-            "system_prompt_suffix": system_prompt_suffix,
-            "messages": [],
-            "api_key": os.getenv("ANTHROPIC_API_KEY", ""),
-        }
-        self.message_queues[session_id] = asyncio.Queue()
+        session = SessionState(
+            model=model,
+            provider=provider,
+            system_prompt_suffix=system_prompt_suffix,
+            api_key=os.getenv("ANTHROPIC_API_KEY", ""),
+        )
+        self.sessions[session_id] = session
         
         # Start processing task for this session
-        task = asyncio.create_task(self._process_session(session_id))
-        self.processing_tasks[session_id] = task
+        session.processing_task = asyncio.create_task(self._process_session(session_id))
+        
+        # Start the consumer that broadcasts sampling-loop output in order
+        session.event_consumer = asyncio.create_task(self._drain_events(session_id))
         
         logger.info(f"Session created: {session_id}")
     
     def remove_session(self, session_id: str):
         """Remove a session and clean up resources."""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-        
-        if session_id in self.message_queues:
-            del self.message_queues[session_id]
-        
-        if session_id in self.websocket_clients:
-            del self.websocket_clients[session_id]
-        
-        if session_id in self.sse_clients:
-            del self.sse_clients[session_id]
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
         
-        if session_id in self.processing_tasks:
-            task = self.processing_tasks[session_id]
-            task.cancel()
-            del self.processing_tasks[session_id]
+        for client in session.websocket_clients.values():
+            client.writer.cancel()
+        if session.processing_task:
+            session.processing_task.cancel()
+        if session.event_consumer:
+            session.event_consumer.cancel()
         
         logger.info(f"Session removed: {session_id}")
     
     def queue_message(self, session_id: str, content: str):
         """Queue a message for processing."""
-        if session_id not in self.message_queues:
+        session = self.sessions.get(session_id)
+        if session is None:
             logger.error(f"Session not found: {session_id}")
             return
         
-        self.message_queues[session_id].put_nowait(content)
+        session.message_queue.put_nowait(content)
         logger.info(f"Message queued for session: {session_id}")
     
     def add_websocket_client(self, session_id: str, websocket: WebSocket):
-        """Add a WebSocket client to a session."""
-        self.websocket_clients[session_id].add(websocket)
+        """Add a WebSocket client to a session, with its own writer task."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            logger.warning(f"WebSocket client for inactive session: {session_id}")
+            return
+        
+        outbox = asyncio.Queue(maxsize=WEBSOCKET_OUTBOX_MAXSIZE)
+        writer = asyncio.create_task(self._write_websocket(session, websocket, outbox))
+        session.websocket_clients[websocket] = WebSocketClient(outbox, writer)
         logger.info(f"WebSocket client added to session: {session_id}")
     
     def remove_websocket_client(self, session_id: str, websocket: WebSocket):
         """Remove a WebSocket client from a session."""
-        if session_id in self.websocket_clients:
-            self.websocket_clients[session_id].discard(websocket)
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        
+        client = session.websocket_clients.pop(websocket, None)
+        if client:
+            client.writer.cancel()
             logger.info(f"WebSocket client removed from session: {session_id}")
     
+    async def _write_websocket(self, session: SessionState, websocket: WebSocket, outbox: asyncio.Queue):
+        """Background task sending one client's queued events."""
+        try:
+            while True:
+                text = await outbox.get()
+                await websocket.send_text(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error sending to WebSocket: {e}")
+            # Drop the dead client; it is this task, so nothing to cancel
+            session.websocket_clients.pop(websocket, None)
+    
     def add_sse_client(self, session_id: str, queue: asyncio.Queue):
         """Add an SSE client to a session."""
-        self.sse_clients[session_id].add(queue)
+        session = self.sessions.get(session_id)
+        if session is None:
+            logger.warning(f"SSE client for inactive session: {session_id}")
+            return
+        
+        session.sse_clients.add(queue)
         logger.info(f"SSE client added to session: {session_id}")
     
     def remove_sse_client(self, session_id: str, queue: asyncio.Queue):
         """Remove an SSE client from a session."""
-        if session_id in self.sse_clients:
-            self.sse_clients[session_id].discard(queue)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.sse_clients.discard(queue)
             logger.info(f"SSE client removed from session: {session_id}")
     
     async def broadcast_to_session(self, session_id: str, event: dict):
         """Broadcast an event to all clients of a session."""
-        # Broadcast to WebSocket clients
-        if session_id in self.websocket_clients:
-            dead_clients = set()
-            for ws in self.websocket_clients[session_id]:
-                try:
-                    await ws.send_json(event)
-                except Exception as e:
-                    logger.error(f"Error sending to WebSocket: {e}")
-                    dead_clients.add(ws)
-            
-            # Remove dead clients
-            for ws in dead_clients:
-                self.websocket_clients[session_id].discard(ws)
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        
+        # Serialize once for every subscriber instead of once per client
+        payload = orjson.dumps(event)
         
-        # Broadcast to SSE clients
-        if session_id in self.sse_clients:
-            dead_clients = set()
-            for queue in self.sse_clients[session_id]:
+        # Hand off to each WebSocket client's writer task; a slow client
+        # loses its oldest pending event rather than blocking the broadcast
+        if session.websocket_clients:
+            text = payload.decode()
+            for client in session.websocket_clients.values():
                 try:
-                    await queue.put(event)
-                except Exception as e:
-                    logger.error(f"Error sending to SSE: {e}")
-                    dead_clients.add(queue)
+                    client.outbox.put_nowait(text)
+                except asyncio.QueueFull:
+                    client.outbox.get_nowait()
+                    client.outbox.put_nowait(text)
+        
+        # Broadcast to SSE clients as a ready-to-send frame
+        if session.sse_clients:
+            if event.get("type") == "close":
+                frame = SSE_CLOSE
+            else:
+                frame = b"data: " + payload + b"\n\n"
+            clients = list(session.sse_clients)
+            results = await asyncio.gather(
+                *(queue.put(frame) for queue in clients),
+                return_exceptions=True
+            )
             
             # Remove dead clients
-            for queue in dead_clients:
-                self.sse_clients[session_id].discard(queue)
+            for queue, result in zip(clients, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error sending to SSE: {result}")
+                    session.sse_clients.discard(queue)
     
     async def _process_session(self, session_id: str):
         """Background task to process messages for a session."""
         logger.info(f"Starting message processor for session: {session_id}")
+        session = self.sessions[session_id]
         
         try:
             while True:
                 # Wait for a message
-                content = await self.message_queues[session_id].get()
+                content = await session.message_queue.get()
                 
                 # Process the message
                 await self._process_message(session_id, content)
@@ -156,12 +265,14 @@ class SessionManager:
             logger.error(f"Session not found: {session_id}")
             return
         
-        # Add user message
+        # Build this turn's conversation on a copy of the history; the session
+        # only picks it up once the turn succeeds
         user_message = {
             "role": "user",
             "content": [{"type": "text", "text": content}]
         }
-        session["messages"].append(user_message)
+        messages = [*session.messages, user_message]
+        turn_start = len(messages)
         
         # Broadcast user message
         await self.broadcast_to_session(session_id, {
@@ -176,37 +287,52 @@ class SessionManager:
             "message": "Processing your request..."
         })
         
-        # Define callbacks
+        # Define callbacks. These are synchronous, so they hand events to the
+        # session's consumer task rather than broadcasting themselves.
+        event_queue = session.event_queue
+        
+        def emit(event: tuple):
+            try:
+                event_queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning(f"Event queue full, dropping {event[0]} event for session: {session_id}")
+        
         def output_callback(content_block: BetaContentBlockParam):
             """Callback for content blocks."""
-            asyncio.create_task(self._handle_output(session_id, content_block))
+            emit(("output", content_block))
         
         def tool_output_callback(result: ToolResult, tool_use_id: str):
             """Callback for tool results."""
-            asyncio.create_task(self._handle_tool_result(session_id, result, tool_use_id))
+            emit(("tool_result", result, tool_use_id))
         
         def api_response_callback(request, response, error):
             """Callback for API responses."""
             if error:
-                asyncio.create_task(self._handle_error(session_id, error))
+                emit(("error", error))
         
         try:
             # Run the sampling loop
             updated_messages = await sampling_loop(
-                model=session["model"],
-                provider=APIProvider(session["provider"]),
-                system_prompt_suffix=session["system_prompt_suffix"],
-                messages=session["messages"],
+                model=session.model,
+                provider=APIProvider(session.provider),
+                system_prompt_suffix=session.system_prompt_suffix,
+                messages=messages,
                 output_callback=output_callback,
                 tool_output_callback=tool_output_callback,
                 api_response_callback=api_response_callback,
-                api_key=session["api_key"],
+                api_key=session.api_key,
                 max_tokens=4096,
                 tool_version="computer_use_20250124",
             )
             
-            # Update session messages
-            session["messages"] = updated_messages
+            # Update session messages, keeping the history bounded
+            session.messages = _trim_history(updated_messages, self.max_history_messages)
+            
+            # Persist the assistant and tool-result messages from this turn
+            await self._save_messages(session_id, updated_messages[turn_start:])
+            
+            # Make sure this turn's output reaches clients before completion
+            await event_queue.join()
             
             # Broadcast completion
             await self.broadcast_to_session(session_id, {
@@ -219,6 +345,44 @@ class SessionManager:
             logger.error(f"Error processing message: {e}")
             await self._handle_error(session_id, e)
     
+    async def _drain_events(self, session_id: str):
+        """Background task to broadcast sampling-loop events in order."""
+        queue = self.sessions[session_id].event_queue
+        handlers = {
+            "output": self._handle_output,
+            "tool_result": self._handle_tool_result,
+            "error": self._handle_error,
+        }
+        
+        try:
+            while True:
+                kind, *args = await queue.get()
+                try:
+                    await handlers[kind](session_id, *args)
+                except Exception as e:
+                    logger.error(f"Error broadcasting {kind} event for session {session_id}: {e}")
+                finally:
+                    queue.task_done()
+                    
+        except asyncio.CancelledError:
+            logger.info(f"Event consumer cancelled for session: {session_id}")
+    
+    async def _save_messages(self, session_id: str, messages: list):
+        """Store a turn's messages in one batched INSERT."""
+        if not messages:
+            return
+        
+        async with self.session_factory() as db:
+            async with db.begin():
+                await crud.create_messages(db, [
+                    {
+                        "session_id": session_id,
+                        "role": message["role"],
+                        "content": message["content"],
+                    }
+                    for message in messages
+                ])
+    
     async def _handle_output(self, session_id: str, content_block: BetaContentBlockParam):
         """Handle output content blocks."""
         if isinstance(content_block, dict):
@@ -5,30 +5,186 @@ VNC proxy for connecting to the virtual desktop.
 import asyncio
 import logging
 import os
-from typing import Optional
+import socket
+from collections import deque
+from typing import Awaitable, Deque, List, Optional, Tuple, cast
 
 from fastapi import WebSocket, WebSocketDisconnect
 
 logger = logging.getLogger(__name__)
 
+# VNC server and noVNC locations
+VNC_HOST = os.getenv("VNC_HOST", "localhost")
+VNC_PORT = int(os.getenv("VNC_PORT", "5900"))
+NOVNC_PORT = int(os.getenv("NOVNC_PORT", "6080"))
+
+# VNC input is small, latency-sensitive packets; don't let Nagle's algorithm
+# hold them back. Set VNC_TCP_NODELAY=0 to allow batching.
+VNC_TCP_NODELAY = os.getenv("VNC_TCP_NODELAY", "1").lower() not in ("0", "false", "no")
+
+# Largest read from, and batched write to, the VNC socket
+VNC_PROXY_BUFSIZE = int(os.getenv("VNC_PROXY_BUFSIZE", "65536"))
+
+# Kernel socket buffer sizes for the VNC connection; 0 keeps the kernel's
+# autotuning, which an explicit size switches off
+VNC_SOCK_RCVBUF = int(os.getenv("VNC_SOCK_RCVBUF", "0"))
+VNC_SOCK_SNDBUF = int(os.getenv("VNC_SOCK_SNDBUF", "0"))
+
+# Most client frames buffered between the WebSocket and the VNC socket
+CLIENT_FRAME_QUEUE_SIZE = 64
+
+# Idle read buffers kept for reuse across VNC connections
+BUFFER_POOL_SIZE = 32
+
+# Reads waiting to be sent to the client before the VNC socket is paused
+MAX_PENDING_READS = 8
+
+
+class _StopRelay(Exception):
+    """Raised when one relay direction ends, so its task group stops the other."""
+
+
+class BufferPool:
+    """Read buffers shared by every VNC connection."""
+    
+    def __init__(self, bufsize: int, count: int):
+        self.bufsize = bufsize
+        self.count = count
+        self._free: List[bytearray] = []
+    
+    def acquire(self) -> bytearray:
+        """Take a free buffer, allocating one if the pool is empty."""
+        return self._free.pop() if self._free else bytearray(self.bufsize)
+    
+    def release(self, buf: bytearray):
+        """Return a buffer once its contents have been sent."""
+        if len(self._free) < self.count:
+            self._free.append(buf)
+
+
+class VNCConnection(asyncio.BufferedProtocol):
+    """
+    Upstream connection to the VNC server.
+    
+    Reads land directly in pooled buffers, which are only taken when the
+    socket has data, so memory follows active transfers rather than open
+    connections. Filled buffers wait in a plain deque for the single
+    coroutine sending them to the client.
+    """
+    
+    # Set in connection_made, before any other callback can run
+    transport: asyncio.Transport
+    
+    def __init__(self, pool: BufferPool):
+        self.pool = pool
+        self._buf: Optional[bytearray] = None
+        self._reads: Deque[Optional[Tuple[bytearray, int]]] = deque()
+        self._read_waiter: Optional[asyncio.Future] = None
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiter: Optional[asyncio.Future] = None
+    
+    def connection_made(self, transport: asyncio.BaseTransport):
+        self.transport = cast(asyncio.Transport, transport)
+    
+    def get_buffer(self, sizehint: int) -> bytearray:
+        if self._buf is None:
+            self._buf = self.pool.acquire()
+        return self._buf
+    
+    def buffer_updated(self, nbytes: int):
+        self._feed((self._buf, nbytes))
+        self._buf = None
+        if len(self._reads) >= MAX_PENDING_READS and not self._reading_paused:
+            self._reading_paused = True
+            self.transport.pause_reading()
+    
+    def eof_received(self) -> bool:
+        self._feed(None)
+        return False
+    
+    def connection_lost(self, exc: Optional[Exception]):
+        self._feed(None)
+        if self._buf is not None:
+            self.pool.release(self._buf)
+            self._buf = None
+        self.resume_writing()
+    
+    def pause_writing(self):
+        self._writing_paused = True
+    
+    def resume_writing(self):
+        self._writing_paused = False
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+    
+    def _feed(self, chunk: Optional[Tuple[bytearray, int]]):
+        self._reads.append(chunk)
+        waiter, self._read_waiter = self._read_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+    
+    async def read(self) -> Optional[Tuple[bytearray, int]]:
+        """Wait for the next pooled buffer and its length; None at EOF."""
+        if not self._reads:
+            self._read_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+        chunk = self._reads.popleft()
+        if self._reading_paused and len(self._reads) < MAX_PENDING_READS:
+            self._reading_paused = False
+            self.transport.resume_reading()
+        return chunk
+    
+    def writelines(self, data: List[bytes]):
+        self.transport.writelines(data)
+    
+    async def drain(self):
+        """Wait until the transport's write buffer is below its limit."""
+        if self.transport.is_closing():
+            raise ConnectionResetError("Connection lost")
+        if not self._writing_paused:
+            return
+        self._drain_waiter = asyncio.get_running_loop().create_future()
+        await self._drain_waiter
+
 
 class VNCProxy:
     """Proxy for VNC connections to the virtual desktop."""
     
-    def __init__(self):
-        self.vnc_host = os.getenv("VNC_HOST", "localhost")
-        self.vnc_port = int(os.getenv("VNC_PORT", "5900"))
-        self.novnc_port = int(os.getenv("NOVNC_PORT", "6080"))
-        
-    def get_connection_info(self) -> dict:
-        """Get VNC connection information."""
-        return {
+    def __init__(
+        self,
+        vnc_host: str = VNC_HOST,
+        vnc_port: int = VNC_PORT,
+        novnc_port: int = NOVNC_PORT,
+        tcp_nodelay: bool = VNC_TCP_NODELAY,
+        bufsize: int = VNC_PROXY_BUFSIZE,
+        sock_rcvbuf: int = VNC_SOCK_RCVBUF,
+        sock_sndbuf: int = VNC_SOCK_SNDBUF
+    ):
+        self.vnc_host = vnc_host
+        self.vnc_port = vnc_port
+        self.novnc_port = novnc_port
+        self.tcp_nodelay = tcp_nodelay
+        self.bufsize = bufsize
+        self.sock_rcvbuf = sock_rcvbuf
+        self.sock_sndbuf = sock_sndbuf
+        self.buffer_pool = BufferPool(self.bufsize, BUFFER_POOL_SIZE)
+        # Fixed for the life of the process, so built once
+        self._connection_info = {
             "vnc_host": self.vnc_host,
             "vnc_port": self.vnc_port,
             "novnc_port": self.novnc_port,
             "novnc_url": f"http://{self.vnc_host}:{self.novnc_port}/vnc.html",
             "websocket_url": f"ws://{self.vnc_host}:{self.novnc_port}/websockify"
         }
+        
+    def get_connection_info(self) -> dict:
+        """Get VNC connection information. Callers must not modify it."""
+        return self._connection_info
     
     async def handle_websocket(self, websocket: WebSocket):
         """
@@ -40,32 +196,23 @@ class VNCProxy:
         
         try:
             # Connect to VNC server
-            reader, writer = await asyncio.open_connection(
+            transport, upstream = await asyncio.get_running_loop().create_connection(
+                lambda: VNCConnection(self.buffer_pool),
                 self.vnc_host,
                 self.vnc_port
             )
+            self._configure_socket(transport)
             
-            # Create tasks for bidirectional data transfer
-            client_to_vnc = asyncio.create_task(
-                self._forward_client_to_vnc(websocket, writer)
-            )
-            vnc_to_client = asyncio.create_task(
-                self._forward_vnc_to_client(reader, websocket)
-            )
-            
-            # Wait for either task to complete (connection closed)
-            done, pending = await asyncio.wait(
-                [client_to_vnc, vnc_to_client],
-                return_when=asyncio.FIRST_COMPLETED
-            )
-            
-            # Cancel remaining tasks
-            for task in pending:
-                task.cancel()
-            
-            # Close connections
-            writer.close()
-            await writer.wait_closed()
+            # Relay both directions until either side closes
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    tg.create_task(self._relay(self._forward_client_to_vnc(websocket, upstream)))
+                    tg.create_task(self._relay(self._forward_vnc_to_client(upstream, websocket)))
+            except* _StopRelay:
+                pass
+            finally:
+                # Close connections
+                transport.close()
             
         except WebSocketDisconnect:
             logger.info("VNC WebSocket disconnected")
@@ -74,25 +221,88 @@ class VNCProxy:
         finally:
             logger.info("VNC WebSocket connection closed")
     
-    async def _forward_client_to_vnc(self, websocket: WebSocket, writer: asyncio.StreamWriter):
+    async def _relay(self, forward: Awaitable[None]):
+        """Run one relay direction, then stop the other one."""
+        await forward
+        raise _StopRelay
+    
+    def _configure_socket(self, transport: asyncio.WriteTransport):
+        """Apply socket and buffering options to the upstream VNC connection."""
+        # Writes only wait in drain() once a full batch is still unsent
+        transport.set_write_buffer_limits(high=self.bufsize)
+        
+        sock = transport.get_extra_info("socket")
+        if sock is None:
+            return
+        
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
+        if self.sock_rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.sock_rcvbuf)
+        if self.sock_sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sock_sndbuf)
+    
+    async def _forward_client_to_vnc(self, websocket: WebSocket, upstream: VNCConnection):
         """Forward data from WebSocket client to VNC server."""
+        # A helper task receives frames so that everything which arrived
+        # during the last write goes out in one writelines() and drain()
+        frames = asyncio.Queue(maxsize=CLIENT_FRAME_QUEUE_SIZE)
+        receiver = asyncio.create_task(self._receive_client_frames(websocket, frames))
+        try:
+            closed = False
+            while not closed:
+                data = await frames.get()
+                if data is None:
+                    break
+                
+                batch = [data]
+                size = len(data)
+                while size < self.bufsize and not frames.empty():
+                    data = frames.get_nowait()
+                    if data is None:
+                        closed = True
+                        break
+                    batch.append(data)
+                    size += len(data)
+                
+                # Returns at once unless the socket is behind by more than
+                # the write buffer's high-water mark
+                upstream.writelines(batch)
+                await upstream.drain()
+        except Exception as e:
+            logger.error(f"Error forwarding client to VNC: {e}")
+        finally:
+            receiver.cancel()
+    
+    async def _receive_client_frames(self, websocket: WebSocket, frames: asyncio.Queue):
+        """Queue WebSocket frames from the client; None marks the end."""
         try:
             while True:
-                data = await websocket.receive_bytes()
-                writer.write(data)
-                await writer.drain()
+                await frames.put(await websocket.receive_bytes())
         except WebSocketDisconnect:
             pass
         except Exception as e:
-            logger.error(f"Error forwarding client to VNC: {e}")
+            logger.error(f"Error receiving from VNC client: {e}")
+        await frames.put(None)
     
-    async def _forward_vnc_to_client(self, reader: asyncio.StreamReader, websocket: WebSocket):
-        """Forward data from VNC server to WebSocket client."""
+    async def _forward_vnc_to_client(self, upstream: VNCConnection, websocket: WebSocket):
+        """
+        Forward data from VNC server to WebSocket client.
+        The bytes have to pass through Python: each chunk is wrapped in a
+        WebSocket frame, and ASGI never exposes the client socket, so a
+        kernel-side splice()/sendfile() between the two isn't possible.
+        """
         try:
             while True:
-                data = await reader.read(4096)
-                if not data:
+                chunk = await upstream.read()
+                if chunk is None:
                     break
-                await websocket.send_bytes(data)
+                buf, nbytes = chunk
+                try:
+                    # The only copy on this path: ASGI servers take bytes
+                    # (wsproto rejects memoryview), and the pooled buffer is
+                    # reused as soon as the send returns
+                    await websocket.send_bytes(bytes(memoryview(buf)[:nbytes]))
+                finally:
+                    self.buffer_pool.release(buf)
         except Exception as e:
             logger.error(f"Error forwarding VNC to client: {e}")
@@ -4,6 +4,7 @@ Script to initialize and test the backend setup.
 
 import asyncio
 import os
+import re
 import sys
 from pathlib import Path
 
@@ -13,116 +14,124 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 import httpx
 from backend.database import init_db
 
+BACKEND_URL = "http://localhost:8000"
 
-async def check_database():
+# Shape of an Anthropic API key
+_API_KEY_PATTERN = re.compile(r"sk-ant-[A-Za-z0-9_-]{20,}")
+
+
+async def check_database(out: list):
     """Check database connection and initialize tables."""
-    print("🗄️  Checking database...")
+    out.append("🗄️  Checking database...")
     try:
         await init_db()
-        print("✅ Database initialized successfully")
+        out.append("✅ Database initialized successfully")
         return True
     except Exception as e:
-        print(f"❌ Database error: {e}")
+        out.append(f"❌ Database error: {e}")
         return False
 
 
-async def check_api_key():
+async def check_api_key(out: list):
     """Check if Anthropic API key is set."""
-    print("\n🔑 Checking API key...")
+    out.append("\n🔑 Checking API key...")
     api_key = os.getenv("ANTHROPIC_API_KEY")
     
     if not api_key:
-        print("❌ ANTHROPIC_API_KEY not set")
-        print("   Set it in .env file or environment variables")
+        out.append("❌ ANTHROPIC_API_KEY not set")
+        out.append("   Set it in .env file or environment variables")
         return False
     
-    if api_key.startswith("sk-ant-"):
-        print("✅ API key found and looks valid")
+    if _API_KEY_PATTERN.fullmatch(api_key):
+        out.append("✅ API key found and looks valid")
         return True
     else:
-        print("⚠️  API key found but format looks unusual")
+        out.append("⚠️  API key found but format looks unusual")
         return True
 
 
-async def check_backend():
+async def check_backend(client: httpx.AsyncClient, out: list):
     """Check if backend is running."""
-    print("\n🌐 Checking backend...")
+    out.append("\n🌐 Checking backend...")
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get("http://localhost:8000/health", timeout=5.0)
-            if response.status_code == 200:
-                data = response.json()
-                print(f"✅ Backend is running")
-                print(f"   Status: {data.get('status')}")
-                print(f"   Active sessions: {data.get('active_sessions', 0)}")
-                return True
-            else:
-                print(f"⚠️  Backend responded with status {response.status_code}")
-                return False
+        response = await client.get("/health", timeout=5.0)
+        if response.status_code == 200:
+            data = response.json()
+            out.append(f"✅ Backend is running")
+            out.append(f"   Status: {data.get('status')}")
+            out.append(f"   Active sessions: {data.get('active_sessions', 0)}")
+            return True
+        else:
+            out.append(f"⚠️  Backend responded with status {response.status_code}")
+            return False
     except httpx.ConnectError:
-        print("❌ Backend is not running")
-        print("   Start it with: docker-compose up")
+        out.append("❌ Backend is not running")
+        out.append("   Start it with: docker-compose up")
         return False
     except Exception as e:
-        print(f"❌ Error checking backend: {e}")
+        out.append(f"❌ Error checking backend: {e}")
         return False
 
 
-async def test_session_creation():
+async def test_session_creation(client: httpx.AsyncClient, out: list):
     """Test creating a session."""
-    print("\n🧪 Testing session creation...")
+    out.append("\n🧪 Testing session creation...")
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://localhost:8000/api/sessions",
-                json={
-                    "model": "claude-sonnet-4-5-20250929",
-                    "provider": "anthropic",
-                    "system_prompt_suffix": "Test session"
-                },
-                timeout=10.0
-            )
+        response = await client.post(
+            "/api/sessions",
+            json={
+                "model": "claude-sonnet-4-5-20250929",
+                "provider": "anthropic",
+                "system_prompt_suffix": "Test session"
+            }
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            session_id = data.get("id")
+            out.append(f"✅ Session created successfully")
+            out.append(f"   ID: {session_id}")
             
-            if response.status_code == 200:
-                data = response.json()
-                session_id = data.get("id")
-                print(f"✅ Session created successfully")
-                print(f"   ID: {session_id}")
-                
-                # Clean up
-                await client.delete(f"http://localhost:8000/api/sessions/{session_id}")
-                print(f"   Cleaned up test session")
-                return True
-            else:
-                print(f"❌ Failed to create session: {response.status_code}")
-                print(f"   Response: {response.text}")
-                return False
+            # Clean up
+            await client.delete(f"/api/sessions/{session_id}")
+            out.append(f"   Cleaned up test session")
+            return True
+        else:
+            out.append(f"❌ Failed to create session: {response.status_code}")
+            out.append(f"   Response: {response.text}")
+            return False
                 
     except Exception as e:
-        print(f"❌ Error testing session creation: {e}")
+        out.append(f"❌ Error testing session creation: {e}")
         return False
 
 
-async def check_vnc():
+async def check_vnc(client: httpx.AsyncClient, out: list):
     """Check VNC configuration."""
-    print("\n🖥️  Checking VNC...")
+    out.append("\n🖥️  Checking VNC...")
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get("http://localhost:8000/api/vnc/info", timeout=5.0)
-            if response.status_code == 200:
-                data = response.json()
-                print(f"✅ VNC configured")
-                print(f"   Host: {data.get('vnc_host')}:{data.get('vnc_port')}")
-                print(f"   noVNC URL: {data.get('novnc_url')}")
-                return True
-            else:
-                print(f"⚠️  VNC endpoint responded with status {response.status_code}")
-                return False
+        response = await client.get("/api/vnc/info", timeout=5.0)
+        if response.status_code == 200:
+            data = response.json()
+            out.append(f"✅ VNC configured")
+            out.append(f"   Host: {data.get('vnc_host')}:{data.get('vnc_port')}")
+            out.append(f"   noVNC URL: {data.get('novnc_url')}")
+            return True
+        else:
+            out.append(f"⚠️  VNC endpoint responded with status {response.status_code}")
+            return False
     except Exception as e:
-        print(f"❌ Error checking VNC: {e}")
+        out.append(f"❌ Error checking VNC: {e}")
         return False
 
 
+def _print_outputs(outputs: list):
+    """Print the collected output of each check, one check after another."""
+    for lines in outputs:
+        for line in lines:
+            print(line)
+
+
 async def main():
     """Run all checks."""
     print("=" * 60)
@@ -131,15 +140,32 @@ async def main():
     
     results = []
     
-    # Run checks
-    results.append(("Database", await check_database()))
-    results.append(("API Key", await check_api_key()))
-    results.append(("Backend", await check_backend()))
-    
-    # Only run these if backend is running
-    if results[-1][1]:
-        results.append(("Session Creation", await test_session_creation()))
-        results.append(("VNC", await check_vnc()))
+    # The backend checks share one connection pool. Session creation (and
+    # its cleanup) get the longer default; the quick probes override it.
+    async with httpx.AsyncClient(base_url=BACKEND_URL, timeout=10.0) as client:
+        # Run the independent checks concurrently. Each collects its own
+        # output, printed in a fixed order once they have all finished.
+        outputs = [[], [], []]
+        database_ok, api_key_ok, backend_ok = await asyncio.gather(
+            check_database(outputs[0]),
+            check_api_key(outputs[1]),
+            check_backend(client, outputs[2])
+        )
+        _print_outputs(outputs)
+        results.append(("Database", database_ok))
+        results.append(("API Key", api_key_ok))
+        results.append(("Backend", backend_ok))
+        
+        # Only run these if backend is running
+        if backend_ok:
+            outputs = [[], []]
+            session_ok, vnc_ok = await asyncio.gather(
+                test_session_creation(client, outputs[0]),
+                check_vnc(client, outputs[1])
+            )
+            _print_outputs(outputs)
+            results.append(("Session Creation", session_ok))
+            results.append(("VNC", vnc_ok))
     
     # Summary
     print("\n" + "=" * 60)
@@ -4,21 +4,35 @@ Tests for the FastAPI backend.
 
 import pytest
 import asyncio
+import json
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi import WebSocketDisconnect
 from httpx import AsyncClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from backend.main import app
-from backend.database import get_db, Base
+from backend import crud
+from backend.database import get_db, set_sqlite_pragma, Base, _check_column_types, _create_all
 from backend.models import SessionCreate
+from backend.session_manager import SessionManager, _trim_history
+from backend.vnc_proxy import BufferPool, VNCConnection, VNCProxy
 
-# Test database URL
-TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+# Test database URL; in memory, so nothing touches the disk
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
-# Create test engine
+# Create test engine. Every in-memory connection is its own database, so
+# StaticPool keeps the one connection all sessions share.
 test_engine = create_async_engine(
     TEST_DATABASE_URL,
     echo=False,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
 )
+event.listen(test_engine.sync_engine, "connect", set_sqlite_pragma)
 
 TestSessionLocal = async_sessionmaker(
     test_engine,
@@ -43,9 +57,9 @@ async def override_get_db():
 app.dependency_overrides[get_db] = override_get_db
 
 
-@pytest.fixture(scope="function")
+@pytest.fixture(scope="module")
 async def setup_database():
-    """Create test database tables."""
+    """Create test database tables once per module."""
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     yield
@@ -53,13 +67,22 @@ async def setup_database():
         await conn.run_sync(Base.metadata.drop_all)
 
 
-@pytest.fixture
-async def client(setup_database):
-    """Create test client."""
+@pytest.fixture(scope="module")
+async def module_client(setup_database):
+    """Create one test client shared by the module."""
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
 
 
+@pytest.fixture
+async def client(module_client):
+    """Test client; tables are emptied after each test."""
+    yield module_client
+    async with test_engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            await conn.execute(table.delete())
+
+
 class TestSessionAPI:
     """Test session management APIs."""
     
@@ -100,6 +123,15 @@ class TestSessionAPI:
         data = response.json()
         assert data["id"] == session_id
     
+    @pytest.mark.asyncio
+    async def test_get_session_invalid_id(self, client):
+        """Test that a session ID that isn't a UUID is a 404."""
+        response = await client.get("/api/sessions/does-not-exist")
+        assert response.status_code == 404
+
+        response = await client.get("/api/sessions/does-not-exist/messages")
+        assert response.status_code == 404
+
     @pytest.mark.asyncio
     async def test_list_sessions(self, client):
         """Test listing sessions."""
@@ -118,6 +150,33 @@ class TestSessionAPI:
         assert response.status_code == 200
         data = response.json()
         assert len(data) == 3
+
+    @pytest.mark.asyncio
+    async def test_list_sessions_pagination(self, client):
+        """Test paging through sessions with the next-page cursor."""
+        for _ in range(3):
+            await client.post(
+                "/api/sessions",
+                json={
+                    "model": "claude-sonnet-4-5-20250929",
+                    "provider": "anthropic"
+                }
+            )
+
+        first_page = await client.get("/api/sessions", params={"limit": 2})
+        assert first_page.status_code == 200
+        assert len(first_page.json()) == 2
+        cursor = first_page.headers["X-Next-Cursor"]
+
+        second_page = await client.get(
+            "/api/sessions", params={"limit": 2, "cursor": cursor}
+        )
+        assert second_page.status_code == 200
+        assert len(second_page.json()) == 1
+        assert "X-Next-Cursor" not in second_page.headers
+
+        seen = {s["id"] for s in first_page.json() + second_page.json()}
+        assert len(seen) == 3
     
     @pytest.mark.asyncio
     async def test_delete_session(self, client):
@@ -167,7 +226,40 @@ class TestMessageAPI:
         data = response.json()
         assert "message_id" in data
         assert data["session_id"] == session_id
-    
+
+    @pytest.mark.asyncio
+    async def test_send_message_unknown_session(self, client):
+        """Test sending a message to a session that doesn't exist."""
+        # A well-formed ID, so the foreign key is what rejects it
+        response = await client.post(
+            f"/api/sessions/{uuid.uuid4()}/messages",
+            json={"content": "Test message"}
+        )
+
+        assert response.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_delete_session_with_messages(self, client):
+        """Test that deleting a session removes its messages."""
+        create_response = await client.post(
+            "/api/sessions",
+            json={
+                "model": "claude-sonnet-4-5-20250929",
+                "provider": "anthropic"
+            }
+        )
+        session_id = create_response.json()["id"]
+        await client.post(
+            f"/api/sessions/{session_id}/messages",
+            json={"content": "Test message"}
+        )
+
+        response = await client.delete(f"/api/sessions/{session_id}")
+        assert response.status_code == 200
+
+        messages_response = await client.get(f"/api/sessions/{session_id}/messages")
+        assert messages_response.json() == []
+
     @pytest.mark.asyncio
     async def test_get_messages(self, client):
         """Test getting messages."""
@@ -197,6 +289,507 @@ class TestMessageAPI:
         data = response.json()
         assert len(data) >= 2
 
+    @pytest.mark.asyncio
+    async def test_get_messages_pagination(self, client):
+        """Test paging through messages with the next-page cursor."""
+        create_response = await client.post(
+            "/api/sessions",
+            json={
+                "model": "claude-sonnet-4-5-20250929",
+                "provider": "anthropic"
+            }
+        )
+        session_id = create_response.json()["id"]
+        for i in range(3):
+            await client.post(
+                f"/api/sessions/{session_id}/messages",
+                json={"content": f"Message {i}"}
+            )
+
+        first_page = await client.get(
+            f"/api/sessions/{session_id}/messages", params={"limit": 2}
+        )
+        cursor = first_page.headers["X-Next-Cursor"]
+        second_page = await client.get(
+            f"/api/sessions/{session_id}/messages",
+            params={"limit": 2, "cursor": cursor}
+        )
+
+        texts = [
+            m["content"][0]["text"]
+            for m in first_page.json() + second_page.json()
+        ]
+        assert texts == ["Message 0", "Message 1", "Message 2"]
+
+
+class TestCRUD:
+    """Test eager loading of session messages."""
+
+    async def _create_session_with_messages(self):
+        """Create a session whose messages are inserted out of timestamp order."""
+        now = datetime.now(timezone.utc)
+        async with TestSessionLocal() as db:
+            async with db.begin():
+                session = await crud.create_session(db, model="claude-sonnet-4-5-20250929", provider="anthropic")
+                await crud.create_messages(db, [
+                    {
+                        "session_id": session.id,
+                        "role": role,
+                        "content": [{"type": "text", "text": role}],
+                        "timestamp": now + timedelta(seconds=offset),
+                    }
+                    for role, offset in (("assistant", 2), ("user", 1), ("user", 3))
+                ])
+        return session.id
+
+    @pytest.mark.asyncio
+    async def test_get_session_with_messages(self, client):
+        """Test that messages are loaded eagerly and ordered by timestamp."""
+        session_id = await self._create_session_with_messages()
+
+        async with TestSessionLocal() as db:
+            session = await crud.get_session_with_messages(db, session_id)
+
+        # Reading after the session has closed would fail on a lazy load
+        assert [m.role for m in session.messages] == ["user", "assistant", "user"]
+        assert session.messages == sorted(session.messages, key=lambda m: m.timestamp)
+
+    @pytest.mark.asyncio
+    async def test_get_sessions_with_messages(self, client):
+        """Test that listing sessions can load every session's messages."""
+        session_id = await self._create_session_with_messages()
+        async with TestSessionLocal() as db:
+            async with db.begin():
+                await crud.create_session(db, model="claude-sonnet-4-5-20250929", provider="anthropic")
+
+        async with TestSessionLocal() as db:
+            sessions = await crud.get_sessions(db, with_messages=True)
+
+        messages = {s.id: [m.role for m in s.messages] for s in sessions}
+        assert len(messages) == 2
+        assert messages.pop(session_id) == ["user", "assistant", "user"]
+        assert list(messages.values()) == [[]]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("returning", [True, False])
+    async def test_update_session(self, client, monkeypatch, returning):
+        """Test updating a session, with and without UPDATE ... RETURNING."""
+        monkeypatch.setattr(test_engine.dialect, "update_returning", returning)
+        async with TestSessionLocal() as db:
+            async with db.begin():
+                created = await crud.create_session(db, model="claude-sonnet-4-5-20250929", provider="anthropic")
+        # Server timestamps have millisecond resolution on SQLite
+        await asyncio.sleep(0.01)
+
+        async with TestSessionLocal() as db:
+            existing = await crud.get_session(db, created.id)
+            updated = await crud.update_session(db, created.id, model="claude-opus-4-1-20250805")
+
+            assert updated is existing
+            assert existing.model == "claude-opus-4-1-20250805"
+            assert existing.updated_at > created.updated_at
+
+            assert await crud.update_session(db, str(uuid.uuid4()), model="m") is None
+
+class TestDatabase:
+    """Test schema creation and upgrades of existing databases."""
+
+    @pytest.mark.asyncio
+    async def test_create_all_adds_message_cascade(self):
+        """Test that an old messages table gains ON DELETE CASCADE."""
+        engine = create_async_engine(
+            "sqlite+aiosqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragma)
+        try:
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql(
+                    "CREATE TABLE sessions (id VARCHAR PRIMARY KEY, model VARCHAR NOT NULL, "
+                    "provider VARCHAR NOT NULL, system_prompt_suffix TEXT, "
+                    "created_at DATETIME, updated_at DATETIME)"
+                )
+                await conn.exec_driver_sql(
+                    "CREATE TABLE messages (id VARCHAR PRIMARY KEY, "
+                    "session_id VARCHAR NOT NULL REFERENCES sessions(id), "
+                    "role VARCHAR NOT NULL, content JSON NOT NULL, timestamp DATETIME)"
+                )
+                await conn.exec_driver_sql(
+                    "INSERT INTO sessions (id, model, provider) VALUES ('s1', 'm', 'anthropic')"
+                )
+                await conn.exec_driver_sql(
+                    "INSERT INTO messages (id, session_id, role, content) VALUES ('m1', 's1', 'user', '[]')"
+                )
+
+            async with engine.begin() as conn:
+                await conn.run_sync(_create_all)
+
+            async with engine.begin() as conn:
+                result = await conn.exec_driver_sql("SELECT id FROM messages")
+                assert result.scalars().all() == ["m1"]
+                await conn.exec_driver_sql("DELETE FROM sessions WHERE id = 's1'")
+                result = await conn.exec_driver_sql("SELECT count(*) FROM messages")
+                assert result.scalar() == 0
+        finally:
+            await engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_sessions_get_timestamps_in_old_table(self):
+        """Test that sessions in a table without server defaults get timestamps."""
+        engine = create_async_engine(
+            "sqlite+aiosqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragma)
+        try:
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql(
+                    "CREATE TABLE sessions (id VARCHAR PRIMARY KEY, model VARCHAR NOT NULL, "
+                    "provider VARCHAR NOT NULL, system_prompt_suffix TEXT, "
+                    "created_at DATETIME, updated_at DATETIME)"
+                )
+                await conn.run_sync(_create_all)
+
+            async with AsyncSession(engine, expire_on_commit=False) as db:
+                async with db.begin():
+                    session = await crud.create_session(db, model="claude-sonnet-4-5-20250929", provider="anthropic")
+
+            assert session.created_at is not None
+            assert session.updated_at is not None
+
+            async with AsyncSession(engine) as db:
+                assert [s.id for s in await crud.get_sessions(db)] == [session.id]
+        finally:
+            await engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_check_column_types(self):
+        """Test that tables with outdated column types are reported."""
+        # _create_all only runs the check on PostgreSQL, but SQLite's
+        # VARCHAR(36) ids are enough to exercise the comparison
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(_check_column_types)
+
+                await conn.exec_driver_sql("DROP TABLE messages")
+                await conn.exec_driver_sql(
+                    "CREATE TABLE messages (id VARCHAR PRIMARY KEY, session_id VARCHAR NOT NULL, "
+                    "role VARCHAR NOT NULL, content JSON NOT NULL, timestamp DATETIME)"
+                )
+                with pytest.raises(RuntimeError, match="messages.session_id is VARCHAR, expected VARCHAR\\(36\\)"):
+                    await conn.run_sync(_check_column_types)
+        finally:
+            await engine.dispose()
+
+class TestSessionManager:
+    """Test session manager persistence."""
+
+    @pytest.mark.asyncio
+    async def test_save_messages(self, client):
+        """Test that a turn's messages are stored."""
+        create_response = await client.post(
+            "/api/sessions",
+            json={
+                "model": "claude-sonnet-4-5-20250929",
+                "provider": "anthropic"
+            }
+        )
+        session_id = create_response.json()["id"]
+
+        manager = SessionManager(session_factory=TestSessionLocal)
+        await manager._save_messages(session_id, [
+            {"role": "assistant", "content": [{"type": "text", "text": "Hi"}]},
+            {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "t1"}]},
+        ])
+
+        response = await client.get(f"/api/sessions/{session_id}/messages")
+        roles = sorted(m["role"] for m in response.json())
+        assert roles == ["assistant", "user"]
+
+    @pytest.mark.asyncio
+    async def test_broadcast_drops_dead_clients(self):
+        """Test that a failing WebSocket client doesn't affect the others."""
+
+        class FakeWebSocket:
+            def __init__(self, fail=False):
+                self.fail = fail
+                self.sent = []
+
+            async def send_text(self, data):
+                if self.fail:
+                    raise RuntimeError("connection closed")
+                self.sent.append(json.loads(data))
+
+        manager = SessionManager(session_factory=TestSessionLocal)
+        manager.create_session("s1", "claude-sonnet-4-5-20250929", "anthropic")
+        alive, dead = FakeWebSocket(), FakeWebSocket(fail=True)
+        manager.add_websocket_client("s1", alive)
+        manager.add_websocket_client("s1", dead)
+        sse_queue = asyncio.Queue()
+        manager.add_sse_client("s1", sse_queue)
+
+        await manager.broadcast_to_session("s1", {"type": "text", "text": "Hi"})
+        # Let the per-client writer tasks run
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        assert alive.sent == [{"type": "text", "text": "Hi"}]
+        assert list(manager.sessions["s1"].websocket_clients) == [alive]
+        assert sse_queue.get_nowait() == b'data: {"type":"text","text":"Hi"}\n\n'
+        manager.remove_session("s1")
+
+    @pytest.mark.asyncio
+    async def test_broadcast_drops_oldest_for_slow_client(self):
+        """Test that a stalled WebSocket client only buffers recent events."""
+
+        class StalledWebSocket:
+            async def send_text(self, data):
+                await asyncio.Event().wait()
+
+        manager = SessionManager(session_factory=TestSessionLocal)
+        manager.create_session("s1", "claude-sonnet-4-5-20250929", "anthropic")
+        ws = StalledWebSocket()
+        manager.add_websocket_client("s1", ws)
+
+        for i in range(100):
+            await manager.broadcast_to_session("s1", {"type": "text", "text": str(i)})
+
+        outbox = manager.sessions["s1"].websocket_clients[ws].outbox
+        assert outbox.full()
+        pending = [json.loads(outbox.get_nowait())["text"] for _ in range(outbox.qsize())]
+        assert pending[-1] == "99"
+        manager.remove_session("s1")
+
+    @pytest.mark.asyncio
+    async def test_process_message_broadcasts_in_order(self, client, monkeypatch):
+        """Test that sampling-loop output reaches clients before completion."""
+        create_response = await client.post(
+            "/api/sessions",
+            json={
+                "model": "claude-sonnet-4-5-20250929",
+                "provider": "anthropic"
+            }
+        )
+        session_id = create_response.json()["id"]
+
+        async def fake_sampling_loop(*, messages, output_callback, **kwargs):
+            for text in ("one", "two"):
+                output_callback({"type": "text", "text": text})
+                await asyncio.sleep(0)
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": "two"}]})
+            return messages
+
+        monkeypatch.setattr("backend.session_manager.sampling_loop", fake_sampling_loop)
+
+        manager = SessionManager(session_factory=TestSessionLocal)
+        manager.create_session(session_id, "claude-sonnet-4-5-20250929", "anthropic")
+        events = asyncio.Queue()
+        manager.add_sse_client(session_id, events)
+
+        await manager._process_message(session_id, "Hello")
+        frames = [events.get_nowait() for _ in range(events.qsize())]
+        manager.remove_session(session_id)
+
+        types = [json.loads(frame[len(b"data: "):])["type"] for frame in frames]
+        assert types == ["user_message", "status", "text", "text", "status"]
+
+    def test_trim_history_starts_at_user_prompt(self):
+        """Test that trimming never leaves a dangling tool result first."""
+        prompt = {"role": "user", "content": [{"type": "text", "text": "Go"}]}
+        tool_use = {"role": "assistant", "content": [{"type": "tool_use", "id": "t1"}]}
+        tool_result = {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "t1"}]}
+        reply = {"role": "assistant", "content": [{"type": "text", "text": "Done"}]}
+        messages = [prompt, tool_use, tool_result, reply] * 2
+
+        assert _trim_history(messages, 5) == messages[4:]
+        assert _trim_history(messages, 2) == messages[4:]
+        assert _trim_history(messages, 0) == messages
+
+
+class FakeVNCServer:
+    """
+    Local stand-in for the VNC server.
+
+    Each connection is sent the greeting, then either hung up on or read
+    until EOF, with everything read put on the received queue.
+    """
+
+    def __init__(self):
+        self.port = 0
+        self.greeting = b""
+        self.hang_up = False
+        self.received = asyncio.Queue()
+
+    async def handle(self, reader, writer):
+        writer.write(self.greeting)
+        await writer.drain()
+        if not self.hang_up:
+            await self.received.put(await reader.read())
+        writer.close()
+
+
+class FakeWebSocket:
+    """Client WebSocket stand-in that replays frames and records what it is sent."""
+
+    def __init__(self, frames=(), wait_for_send=False):
+        self.frames = list(frames)
+        self.sent = []
+        # Optionally hold back the frames until the client has been sent something
+        self._can_receive = asyncio.Event()
+        if not wait_for_send:
+            self._can_receive.set()
+
+    async def accept(self):
+        pass
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+        self._can_receive.set()
+
+    async def receive_bytes(self):
+        await self._can_receive.wait()
+        if not self.frames:
+            raise WebSocketDisconnect()
+        return self.frames.pop(0)
+
+
+@pytest.fixture
+async def vnc_server():
+    """Run a FakeVNCServer on a free local port."""
+    fake = FakeVNCServer()
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    fake.port = server.sockets[0].getsockname()[1]
+    yield fake
+    server.close()
+    await server.wait_closed()
+
+
+class TestVNCProxy:
+    """Test VNC proxy connection handling."""
+
+    @pytest.mark.asyncio
+    async def test_vnc_info(self, client):
+        """Test getting VNC connection information."""
+        response = await client.get("/api/vnc/info")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["novnc_url"] == f"http://{data['vnc_host']}:{data['novnc_port']}/vnc.html"
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("enabled", [True, False])
+    async def test_tcp_nodelay(self, vnc_server, enabled):
+        """Test that tcp_nodelay controls Nagle on the upstream socket."""
+        proxy = VNCProxy(tcp_nodelay=enabled)
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", vnc_server.port)
+        try:
+            proxy._configure_socket(writer.transport)
+            sock = writer.get_extra_info("socket")
+            assert bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)) is enabled
+        finally:
+            writer.close()
+
+    @pytest.mark.asyncio
+    async def test_socket_buffer_sizes(self, vnc_server):
+        """Test that the upstream socket and transport buffers are sized."""
+        proxy = VNCProxy(bufsize=32768, sock_rcvbuf=65536, sock_sndbuf=65536)
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", vnc_server.port)
+        try:
+            proxy._configure_socket(writer.transport)
+            sock = writer.get_extra_info("socket")
+            # Linux doubles the requested size for bookkeeping overhead
+            assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 65536
+            assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 65536
+            assert writer.transport.get_write_buffer_limits()[1] == 32768
+        finally:
+            writer.close()
+
+    @pytest.mark.asyncio
+    async def test_forward_client_to_vnc(self, vnc_server):
+        """Test that batched client frames reach the VNC server in order."""
+        proxy = VNCProxy()
+        transport, upstream = await asyncio.get_running_loop().create_connection(
+            lambda: VNCConnection(proxy.buffer_pool), "127.0.0.1", vnc_server.port
+        )
+        frames = [bytes([i]) * 10 for i in range(20)]
+        try:
+            await proxy._forward_client_to_vnc(FakeWebSocket(frames), upstream)
+            transport.write_eof()
+            assert await vnc_server.received.get() == b"".join(frames)
+        finally:
+            transport.close()
+
+    @pytest.mark.asyncio
+    async def test_forward_vnc_to_client(self, vnc_server):
+        """Test that VNC server output reaches the client and buffers are reused."""
+
+        class CountingPool(BufferPool):
+            allocated = 0
+
+            def acquire(self):
+                if not self._free:
+                    self.allocated += 1
+                return super().acquire()
+
+        payload = bytes(range(256)) * 1000
+        vnc_server.greeting = payload
+        vnc_server.hang_up = True
+
+        proxy = VNCProxy()
+        proxy.buffer_pool = CountingPool(4096, 4)
+        transport, upstream = await asyncio.get_running_loop().create_connection(
+            lambda: VNCConnection(proxy.buffer_pool), "127.0.0.1", vnc_server.port
+        )
+        websocket = FakeWebSocket()
+        try:
+            await proxy._forward_vnc_to_client(upstream, websocket)
+            assert all(type(data) is bytes for data in websocket.sent)
+            assert b"".join(websocket.sent) == payload
+            assert proxy.buffer_pool.allocated < len(websocket.sent)
+        finally:
+            transport.close()
+
+    @pytest.mark.asyncio
+    async def test_vnc_reads_pause_until_sent(self, vnc_server):
+        """Test that a client falling behind pauses reads from the VNC server."""
+        payload = b"x" * (1024 * 64)
+        vnc_server.greeting = payload
+        vnc_server.hang_up = True
+
+        transport, upstream = await asyncio.get_running_loop().create_connection(
+            lambda: VNCConnection(BufferPool(1024, 4)), "127.0.0.1", vnc_server.port
+        )
+        try:
+            for _ in range(100):
+                if not transport.is_reading():
+                    break
+                await asyncio.sleep(0.01)
+            assert not transport.is_reading()
+
+            received = b""
+            while (chunk := await upstream.read()) is not None:
+                buf, nbytes = chunk
+                received += buf[:nbytes]
+            assert received == payload
+        finally:
+            transport.close()
+
+    @pytest.mark.asyncio
+    async def test_handle_websocket_stops_when_client_leaves(self, vnc_server):
+        """Test that the relay ends once either side closes."""
+        vnc_server.greeting = b"RFB 003.008\n"
+
+        proxy = VNCProxy(vnc_host="127.0.0.1", vnc_port=vnc_server.port)
+        websocket = FakeWebSocket([b"ClientInit"], wait_for_send=True)
+        await asyncio.wait_for(proxy.handle_websocket(websocket), timeout=5)
+        assert websocket.sent == [b"RFB 003.008\n"]
+        assert await vnc_server.received.get() == b"ClientInit"
+
 
 class TestHealthCheck:
     """Test health check endpoint."""